@@ -1,9 +1,12 @@
 from .objects_type import PageInfoExtra
 from .connection import PaginationConnection
 from .connection_field import DjangoPaginationConnectionField
+from .loaders import ModelLoader, get_loader
 
 __all__ = [
     "PageInfoExtra",
     "PaginationConnection",
-    "DjangoPaginationConnectionField"
+    "DjangoPaginationConnectionField",
+    "ModelLoader",
+    "get_loader",
 ]
@@ -1,17 +1,117 @@
+import hashlib
+import json
 import logging
-import re
-from functools import partial
+import string
+from functools import lru_cache, partial
 
-from django.core.paginator import Paginator
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import Count, QuerySet, Window
 from graphene import Int, String
 from graphene_django.filter import DjangoFilterConnectionField
 from graphene_django.settings import graphene_settings
 from graphene_django.utils import maybe_queryset
+from promise import Promise
 
 from . import PageInfoExtra, PaginationConnection
+from .loaders import store_results
+from .optimization import optimize_queryset, selected_fields
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Cache used for expensive total counts. Only counts at or above the threshold
+# are cached, since small counts are cheap to recompute.
+count_cache = cache
+COUNT_CACHE_THRESHOLD = 1000
+COUNT_CACHE_TIMEOUT = 60
+
+# On PostgreSQL, planner row estimates above this threshold can be returned as
+# the total count instead of running an exact COUNT. Estimates can be far off
+# for filtered querysets, so this is disabled (None) unless set.
+ESTIMATE_COUNT_THRESHOLD = None
+
+# Past this offset, QuerySet pages are fetched by first slicing only the
+# primary keys, so the database doesn't read full rows for skipped items.
+PK_SLICE_OFFSET_THRESHOLD = 500
+
+# Unlimited QuerySet results are streamed from the database in chunks of this
+# size instead of being loaded in memory all at once.
+UNLIMITED_CHUNK_SIZE = 2000
+
+
+@lru_cache(maxsize=256)
+def _camel_to_snake(name):
+    """Convert a camelCase GraphQL field name to a snake_case model field."""
+    out = []
+    for i, c in enumerate(name):
+        if i and "A" <= c <= "Z":
+            out.append("_")
+        out.append(c)
+    return "".join(out).translate(_ASCII_LOWER)
+
+
+def resolve_total_count(root, info, **kwargs):
+    """Resolve the total count of items, using cache if available."""
+    cached = getattr(info.context, "_CachedDjangoPaginationField", _MISSING)
+    if cached is not _MISSING:
+        return cached
+    return cached_count(root.iterable)
+
+
+def _query_sql(queryset):
+    return queryset.query.get_compiler(queryset.db).as_sql()
+
+
+def _count_cache_key(queryset, sql, params):
+    digest = hashlib.md5(repr((queryset.db, sql, params)).encode()).hexdigest()
+    return "graphene_django_pagination:count:{}".format(digest)
+
+
+def _estimate_count(queryset, sql, params):
+    """Return the PostgreSQL planner row estimate for the query, if available."""
+    connection = connections[queryset.db]
+    if ESTIMATE_COUNT_THRESHOLD is None or connection.vendor != "postgresql":
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    estimate = plan[0]["Plan"]["Plan Rows"]
+    return estimate if estimate > ESTIMATE_COUNT_THRESHOLD else None
+
+
+def cached_count(iterable):
+    """Count the items, sharing large QuerySet counts through `count_cache`.
+
+    On PostgreSQL, very large results are counted from the planner estimate
+    when `ESTIMATE_COUNT_THRESHOLD` is set.
+    """
+    if not isinstance(iterable, QuerySet):
+        return iterable.count()
+
+    try:
+        sql, params = _query_sql(iterable)
+    except EmptyResultSet:
+        return 0
+
+    key = _count_cache_key(iterable, sql, params)
+    total_count = count_cache.get(key)
+    if total_count is None:
+        total_count = _estimate_count(iterable, sql, params)
+    if total_count is None:
+        total_count = iterable.count()
+        if total_count >= COUNT_CACHE_THRESHOLD:
+            count_cache.set(key, total_count, COUNT_CACHE_TIMEOUT)
+    return total_count
+
 
 class DjangoPaginationConnectionField(DjangoFilterConnectionField):
     def __init__(
@@ -30,6 +130,7 @@ class DjangoPaginationConnectionField(DjangoFilterConnectionField):
         self._filterset_class = None
         self._extra_filter_meta = extra_filter_meta
         self._base_args = None
+        self._cached_type = None
         kwargs["max_limit"] = kwargs.get("max_limit") or graphene_settings.RELAY_CONNECTION_MAX_LIMIT
         kwargs.setdefault("limit", Int(description="Query limit"))
         kwargs.setdefault("offset", Int(description="Query offset"))
@@ -39,24 +140,25 @@ class DjangoPaginationConnectionField(DjangoFilterConnectionField):
 
     @property
     def type(self):
-        class NodeConnection(PaginationConnection):
-            total_count = Int()
+        if self._cached_type is None:
+            class NodeConnection(PaginationConnection):
+                total_count = Int()
+
+                class Meta:
+                    node = self._type
+                    name = "{}NodeConnection".format(self._type._meta.name)
 
-            class Meta:
-                node = self._type
-                name = "{}NodeConnection".format(self._type._meta.name)
+                resolve_total_count = resolve_total_count
 
-            def resolve_total_count(self, info, **kwargs):
-                """Resolve the total count of items, using cache if available."""
-                if hasattr(info.context, "_CachedDjangoPaginationField"):
-                    return info.context._CachedDjangoPaginationField
-                return self.iterable.count()
+            self._cached_type = NodeConnection
 
-        return NodeConnection
+        return self._cached_type
 
     @classmethod
     def _resolve_connection(cls, connection, args, iterable, max_limit=None, info=None):
         iterable = maybe_queryset(iterable)
+        if info is not None:
+            iterable = optimize_queryset(iterable, info, connection._meta.node)
 
         ordering = args.get("ordering")
 
@@ -75,17 +177,6 @@ class DjangoPaginationConnectionField(DjangoFilterConnectionField):
 
         return connection
 
-    @classmethod
-    def resolve_connection(cls, connection, args, iterable, max_limit=None):
-        """Hacky way to add info context to the connection resolver."""
-        return partial(
-            cls._resolve_connection,
-            connection,
-            args,
-            iterable,
-            max_limit=max_limit,
-        )
-
     @classmethod
     def connection_resolver(
         cls,
@@ -99,21 +190,54 @@ class DjangoPaginationConnectionField(DjangoFilterConnectionField):
         info,
         **args,
     ):
-        """Resolve the connection, ensuring the info context is passed to partials."""
-        res = super().connection_resolver(
-            resolver,
+        """Resolve the queryset and paginate it, passing info along."""
+        if enforce_first_or_last:
+            assert args.get("first") or args.get("last"), (
+                "You must provide a `first` or `last` value to properly paginate the `{}` connection."
+            ).format(info.field_name)
+
+        iterable = resolver(root, info, **args)
+        if Promise.is_thenable(iterable):
+            on_resolve = partial(
+                cls._resolve_iterable,
+                connection,
+                default_manager,
+                queryset_resolver,
+                max_limit,
+                info,
+                args,
+            )
+            return Promise.resolve(iterable).then(on_resolve)
+
+        return cls._resolve_iterable(
             connection,
             default_manager,
             queryset_resolver,
             max_limit,
-            enforce_first_or_last,
-            root,
             info,
-            **args,
+            args,
+            iterable,
+        )
+
+    @classmethod
+    def _resolve_iterable(
+        cls,
+        connection,
+        default_manager,
+        queryset_resolver,
+        max_limit,
+        info,
+        args,
+        iterable,
+    ):
+        # The queryset resolver reads the model off the queryset, so promises
+        # have to be resolved before it runs
+        if iterable is None:
+            iterable = default_manager
+        iterable = queryset_resolver(connection, iterable, info, args)
+        return cls._resolve_connection(
+            connection, args, iterable, max_limit=max_limit, info=info
         )
-        if isinstance(res, partial):
-            return res(info=info)
-        return res
 
 
 def connection_from_list_slice(
@@ -125,28 +249,38 @@ def connection_from_list_slice(
     max_limit=None,
 ):
     args = args or {}
-    limit = args.get("limit", None)
-    offset = args.get("offset", 0)
+    limit = args.get("limit")
+    offset = args.get("offset") or 0
 
     # Enforce max_limit if set
     if max_limit is not None:
         if limit is None:
             limit = max_limit
         elif limit > max_limit:
-            try:
-                operation_name = info.operation.name.value
-            except Exception:
-                operation_name = "unknown"
-            logger.warning(
-                "Query '%s' limit %d exceeded max_limit %d, capping to %d",
-                operation_name,
-                limit,
-                max_limit,
-                max_limit,
-            )
+            if logger.isEnabledFor(logging.WARNING):
+                operation = getattr(info, "operation", None)
+                if operation and operation.name:
+                    operation_name = operation.name.value
+                else:
+                    operation_name = "unknown"
+                logger.warning(
+                    "Query '%s' limit %d exceeded max_limit %d, capping to %d",
+                    operation_name,
+                    limit,
+                    max_limit,
+                    max_limit,
+                )
             limit = max_limit
 
     if limit is None:
+        # QuerySet.iterator() ignores prefetch_related, so keep evaluating
+        # querysets that have prefetches as a whole
+        if (
+            isinstance(list_slice, QuerySet)
+            and not list_slice._prefetch_related_lookups
+        ):
+            list_slice = _StreamedQuerySet(list_slice, UNLIMITED_CHUNK_SIZE)
+
         return connection_type(
             results=list_slice,
             page_info=pageinfo_type(has_previous_page=False, has_next_page=False),
@@ -155,60 +289,139 @@ def connection_from_list_slice(
         assert isinstance(limit, int), "Limit must be of type int"
         assert limit > 0, "Limit must be positive integer greater than 0"
 
-        # Fetch the requested slice
-        _slice = list_slice[offset : (offset + limit)]
-        _slice_list = list(_slice)
+        # When totalCount is selected, fetch it along with the page unless
+        # it is already cached
+        total_count = None
+        count_key = _window_count_key(list_slice, offset, info)
+        if count_key is not None:
+            total_count = count_cache.get(count_key)
+            if total_count is None:
+                list_slice = list_slice.annotate(
+                    _pagination_total_count=Window(expression=Count("*"))
+                )
+
+        # Fetch one row past the requested slice to know whether there is
+        # a next page without running a COUNT query
+        _slice_list = _fetch_slice(list_slice, offset, offset + limit + 1)
+        has_next_page = len(_slice_list) > limit
+        _slice_list = _slice_list[:limit]
         actual_count = len(_slice_list)
 
-        # Optimization: skip COUNT query when we can determine we're on the last page:
+        # Keep the fetched instances so nested resolvers can get them from
+        # the request's loader without querying them again
+        if (
+            info is not None
+            and isinstance(list_slice, QuerySet)
+            and list_slice._fields is None
+        ):
+            store_results(info, list_slice.model, _slice_list)
+        has_previous_page = offset > 0
+
+        # The total is known without a COUNT query when we're on the last page:
         # 1. offset=0 and got 0 items → empty dataset, total=0
-        # 2. got at least 1 item but < limit → last page, total=offset+actual_count
-        if (actual_count == 0 and offset == 0) or (0 < actual_count < limit):
+        # 2. got at least 1 item and no next page → total=offset+actual_count
+        # Otherwise it comes from the window count if one was fetched, or
+        # totalCount falls back to a COUNT, only if it is requested.
+        if not has_next_page and (actual_count > 0 or offset == 0):
             total_count = offset + actual_count
-            has_next_page = False
-            has_previous_page = offset > 0
+        elif total_count is None and count_key is not None and _slice_list:
+            total_count = _slice_list[0]._pagination_total_count
+            if total_count >= COUNT_CACHE_THRESHOLD:
+                count_cache.set(count_key, total_count, COUNT_CACHE_TIMEOUT)
 
+        if total_count is not None:
             info.context._CachedDjangoPaginationField = total_count
+        elif hasattr(info.context, "_CachedDjangoPaginationField"):
+            del info.context._CachedDjangoPaginationField
 
-            return connection_type(
-                results=_slice_list,
-                page_info=pageinfo_type(
-                    has_previous_page=has_previous_page, has_next_page=has_next_page
-                ),
-            )
-        else:
-            # We got exactly 'limit' items, so we need to use the paginator
-            # to determine if there are more pages (requires COUNT query)
-            paginator = Paginator(list_slice, limit)
-            total_count = paginator.count
+        return connection_type(
+            results=_slice_list,
+            page_info=pageinfo_type(
+                has_previous_page=has_previous_page, has_next_page=has_next_page
+            ),
+        )
 
-            # Calculate has_previous/has_next based on offset, not page numbers
-            # since offsets don't necessarily align with page boundaries
-            has_previous_page = offset > 0
-            has_next_page = (offset + limit) < total_count
 
-            info.context._CachedDjangoPaginationField = total_count
+def _window_count_key(list_slice, offset, info):
+    """Return the count cache key if the page should carry a window total count.
 
-            return connection_type(
-                results=_slice_list,
-                page_info=pageinfo_type(
-                    has_previous_page=has_previous_page, has_next_page=has_next_page
-                ),
-            )
+    Only done when totalCount is selected and the backend supports window
+    functions. PostgreSQL keeps using planner estimates when they are enabled,
+    and deep offsets are fetched by primary key, which would count the page.
+    """
+    if (
+        info is None
+        or not isinstance(list_slice, QuerySet)
+        or list_slice._fields is not None
+        or list_slice.query.distinct
+        or list_slice.query.combinator
+        or list_slice.query.is_sliced
+        or offset > PK_SLICE_OFFSET_THRESHOLD
+    ):
+        return None
 
+    connection = connections[list_slice.db]
+    if not connection.features.supports_over_clause:
+        return None
+    if connection.vendor == "postgresql" and ESTIMATE_COUNT_THRESHOLD is not None:
+        return None
+    if "totalCount" not in selected_fields(info):
+        return None
 
-def connection_from_list_ordering(items_list, ordering, connection):
-    field, order = ordering.replace(" ", "").split(",")
-    field = re.sub(r"(?<!^)(?=[A-Z])", "_", field).lower()
-    order = "-" if order == "desc" else ""
+    try:
+        return _count_cache_key(list_slice, *_query_sql(list_slice))
+    except EmptyResultSet:
+        return None
+
+
+class _StreamedQuerySet(object):
+    """Stream a QuerySet in chunks on every iteration, without caching rows.
+
+    Unlike a bare `QuerySet.iterator()`, it can be iterated again, e.g. when
+    `results` is selected more than once through aliases.
+    """
 
+    def __init__(self, queryset, chunk_size):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        return self.queryset.iterator(chunk_size=self.chunk_size)
+
+
+def _fetch_slice(list_slice, start, stop):
     if (
-        connection
-        and connection._meta
-        and connection._meta.node
-        and hasattr(connection._meta.node, "ordering")
-        and callable(getattr(connection._meta.node, "ordering"))
+        start > PK_SLICE_OFFSET_THRESHOLD
+        and isinstance(list_slice, QuerySet)
+        and list_slice._fields is None
+        and not list_slice.query.combinator
+        and not list_slice.query.is_sliced
     ):
-        return connection._meta.node.ordering(items_list, field, order)
+        pks = list(list_slice.values_list("pk", flat=True)[start:stop])
+        objects = list_slice.in_bulk(pks)
+        return [objects[pk] for pk in pks]
+    return list(list_slice[start:stop])
+
+
+def connection_from_list_ordering(items_list, ordering, connection):
+    field, _, order = ordering.partition(",")
+    field = _camel_to_snake(field.strip())
+    order = "-" if order.strip() == "desc" else ""
+
+    orderer = _get_orderer(connection) if connection else None
+    if orderer:
+        return orderer(items_list, field, order)
     else:
         return items_list.order_by(f"{order}{field}")
+
+
+def _get_orderer(connection):
+    """Return the node's `ordering` callable, cached on the connection class."""
+    orderer = connection.__dict__.get("_cached_orderer", _MISSING)
+    if orderer is _MISSING:
+        node = connection._meta.node if connection._meta else None
+        orderer = getattr(node, "ordering", None)
+        if not callable(orderer):
+            orderer = None
+        connection._cached_orderer = orderer
+    return orderer
@@ -0,0 +1,47 @@
+from promise import Promise
+from promise.dataloader import DataLoader
+
+
+class ModelLoader(DataLoader):
+    """Load model instances by primary key, batching lookups into one query."""
+
+    def __init__(self, model, **kwargs):
+        super(ModelLoader, self).__init__(**kwargs)
+        self.model = model
+
+    def batch_load_fn(self, keys):
+        objects = self.model._default_manager.in_bulk(keys)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+def get_loader(info, model):
+    """Return the request's loader for `model`.
+
+    The loader is primed with the instances of that model already fetched by
+    paginated connections during the request.
+    """
+    loaders = _context_dict(info, "_pagination_loaders")
+    loader = loaders.get(model)
+    if loader is None:
+        loader = loaders[model] = ModelLoader(model)
+        for obj in _context_dict(info, "_pagination_results").pop(model, ()):
+            loader.prime(obj.pk, obj)
+    return loader
+
+
+def store_results(info, model, results):
+    """Keep a page of results to prime the request's loader for `model`."""
+    loader = _context_dict(info, "_pagination_loaders").get(model)
+    if loader is None:
+        _context_dict(info, "_pagination_results").setdefault(model, []).extend(results)
+    else:
+        for obj in results:
+            loader.prime(obj.pk, obj)
+
+
+def _context_dict(info, name):
+    value = getattr(info.context, name, None)
+    if value is None:
+        value = {}
+        setattr(info.context, name, value)
+    return value
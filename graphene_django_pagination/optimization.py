@@ -0,0 +1,157 @@
+from functools import lru_cache
+
+from django.db.models import QuerySet
+from django.db.models.fields.related_descriptors import (
+    ForwardManyToOneDescriptor,
+    ReverseManyToOneDescriptor,
+    ReverseOneToOneDescriptor,
+)
+from graphene import Dynamic
+from graphene.utils.str_converters import to_camel_case
+from graphene_django import DjangoObjectType
+
+
+def optimize_queryset(queryset, info, node_type):
+    """Join or prefetch the model relations selected under `results`.
+
+    A node type can replace the lookups used for one of its fields with an
+    `optimizations` dict, e.g.
+    `{"author": {"select_related": ["author__profile"]}}`.
+    """
+    if (
+        not isinstance(queryset, QuerySet)
+        or queryset._fields is not None
+        or queryset.query.combinator
+        or queryset.query.deferred_loading[0]
+    ):
+        return queryset
+
+    select_related = []
+    prefetch_related = []
+    for field_ast in _field_asts(info):
+        for selection in _selections(info, field_ast):
+            if selection.name.value == "results":
+                _collect(
+                    info,
+                    selection,
+                    node_type,
+                    "",
+                    False,
+                    select_related,
+                    prefetch_related,
+                )
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+def selected_fields(info):
+    """Return the GraphQL names of the fields selected on the connection."""
+    return {
+        selection.name.value
+        for field_ast in _field_asts(info)
+        for selection in _selections(info, field_ast)
+    }
+
+
+def _field_asts(info):
+    return getattr(info, "field_nodes", None) or info.field_asts
+
+
+def _collect(
+    info, field_ast, node_type, prefix, in_prefetch, select_related, prefetch_related
+):
+    graphql_fields = _graphql_fields(node_type)
+    model = node_type._meta.model
+    hints = getattr(node_type, "optimizations", None) or {}
+
+    for selection in _selections(info, field_ast):
+        name = graphql_fields.get(selection.name.value)
+        if name is None:
+            continue
+
+        if name in hints:
+            lookups = [
+                prefix + lookup for lookup in hints[name].get("select_related", ())
+            ]
+            if in_prefetch:
+                prefetch_related.extend(lookups)
+            else:
+                select_related.extend(lookups)
+            prefetch_related.extend(
+                prefix + lookup for lookup in hints[name].get("prefetch_related", ())
+            )
+            continue
+
+        multi_valued = _is_multi_valued(model, name)
+        if multi_valued is None or selection.selection_set is None:
+            continue
+        related_type = _django_type(node_type._meta.fields[name])
+        if related_type is None:
+            continue
+
+        path = prefix + name
+        prefetch = in_prefetch or multi_valued
+        if prefetch:
+            prefetch_related.append(path)
+        else:
+            select_related.append(path)
+        _collect(
+            info,
+            selection,
+            related_type,
+            path + "__",
+            prefetch,
+            select_related,
+            prefetch_related,
+        )
+
+
+def _selections(info, node):
+    for selection in node.selection_set.selections:
+        kind = type(selection).__name__
+        if kind in ("FragmentSpread", "FragmentSpreadNode"):
+            yield from _selections(info, info.fragments[selection.name.value])
+        elif kind in ("InlineFragment", "InlineFragmentNode"):
+            yield from _selections(info, selection)
+        else:
+            yield selection
+
+
+@lru_cache(maxsize=None)
+def _graphql_fields(node_type):
+    """Map the GraphQL names of a node type's fields to their attribute names."""
+    graphql_fields = {}
+    for name, field in node_type._meta.fields.items():
+        graphql_fields[name] = name
+        graphql_fields[getattr(field, "name", None) or to_camel_case(name)] = name
+    return graphql_fields
+
+
+def _is_multi_valued(model, name):
+    """Tell whether a model attribute is a relation to one or many objects.
+
+    Returns None for attributes that aren't relations.
+    """
+    descriptor = getattr(model, name, None)
+    if isinstance(descriptor, ReverseManyToOneDescriptor):
+        return True
+    if isinstance(descriptor, (ForwardManyToOneDescriptor, ReverseOneToOneDescriptor)):
+        return False
+    return None
+
+
+def _django_type(field):
+    if isinstance(field, Dynamic):
+        field = field.get_type()
+        if field is None:
+            return None
+    _type = field.type
+    while hasattr(_type, "of_type"):
+        _type = _type.of_type
+    if isinstance(_type, type) and issubclass(_type, DjangoObjectType):
+        return _type
+    return None
@@ -1,8 +1,9 @@
-from graphene import ObjectType, Schema
+from graphene import Int, List, ObjectType, Schema, String
 from graphene_django import DjangoObjectType
 from django.db import models
 from django.db import connection
 
+from graphene_django_pagination import get_loader
 from graphene_django_pagination.connection_field import DjangoPaginationConnectionField
 
 
@@ -14,12 +15,30 @@ class TestItem(models.Model):
     class Meta:
         app_label = 'test_app'
 
-# Create the table (simple approach)
+
+class TestCategory(models.Model):
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = 'test_app'
+
+
+class TestProduct(models.Model):
+    name = models.CharField(max_length=100)
+    category = models.ForeignKey(
+        TestCategory, related_name='products', on_delete=models.CASCADE
+    )
+
+    class Meta:
+        app_label = 'test_app'
+
+# Create the tables (simple approach)
 with connection.schema_editor() as schema_editor:
-    try:
-        schema_editor.create_model(TestItem)
-    except:
-        pass  # Table might already exist
+    for model in (TestItem, TestCategory, TestProduct):
+        try:
+            schema_editor.create_model(model)
+        except:
+            pass  # Table might already exist
 
 
 class TestItemType(DjangoObjectType):
@@ -43,9 +62,55 @@ class TestItemLimitedType(DjangoObjectType):
         }
 
 
+class TestTopItemType(DjangoObjectType):
+    class Meta:
+        model = TestItem
+        name = 'TestTopItem'
+        fields = ('id', 'name', 'value')
+        filter_fields = ['name']
+
+
+class TestCategoryType(DjangoObjectType):
+    class Meta:
+        model = TestCategory
+        fields = ('id', 'name', 'products')
+        filter_fields = ['name']
+
+    product_names = List(String)
+
+    optimizations = {'product_names': {'prefetch_related': ['products']}}
+
+    def resolve_product_names(self, info):
+        return [product.name for product in self.products.all()]
+
+
+class TestProductType(DjangoObjectType):
+    class Meta:
+        model = TestProduct
+        fields = ('id', 'name', 'category')
+        filter_fields = ['name']
+
+    category_name = String()
+
+    optimizations = {'category_name': {'select_related': ['category']}}
+
+    def resolve_category_name(self, info):
+        return self.category.name
+
+    @classmethod
+    def ordering(cls, queryset, field, order):
+        if field == 'category_name':
+            field = 'category__name'
+        return queryset.order_by(f"{order}{field}", 'id')
+
+
 class Query(ObjectType):
     items = DjangoPaginationConnectionField(TestItemType)
     items_limited = DjangoPaginationConnectionField(TestItemLimitedType, max_limit=3)
+    top_items = DjangoPaginationConnectionField(TestTopItemType)
+    categories = DjangoPaginationConnectionField(TestCategoryType)
+    products = DjangoPaginationConnectionField(TestProductType)
+    items_by_pk = List(TestItemType, pks=List(Int, required=True))
     
     def resolve_items(self, info, **kwargs):
         return TestItem.objects.all()
@@ -53,5 +118,18 @@ class Query(ObjectType):
     def resolve_items_limited(self, info, **kwargs):
         return TestItem.objects.all()
 
+    def resolve_top_items(self, info, **kwargs):
+        return TestItem.objects.order_by('id')[:5]
+
+    def resolve_categories(self, info, **kwargs):
+        return TestCategory.objects.all()
+
+    def resolve_products(self, info, **kwargs):
+        return TestProduct.objects.all()
+
+    def resolve_items_by_pk(self, info, pks):
+        loader = get_loader(info, TestItem)
+        return [loader.load(pk) for pk in pks]
+
 
 schema = Schema(query=Query)
@@ -1,178 +1,186 @@
 from django.test.client import RequestFactory
 from django.test.utils import CaptureQueriesContext
-from django.db import connection
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from graphene import ObjectType, Schema
+from graphene_django.settings import graphene_settings
+from graphql import validate
+from graphql.backend import GraphQLCachedBackend, GraphQLCoreBackend
+from graphql.execution import ExecutionResult, execute
+from promise import Promise
 import pytest
 
-from .fake_project import TestItem, schema
+from graphene_django_pagination import (
+    DjangoPaginationConnectionField,
+    PageInfoExtra,
+    connection_field,
+)
+from graphene_django_pagination.connection_field import (
+    _camel_to_snake,
+    connection_from_list_slice,
+    count_cache,
+)
+from graphene_django_pagination.optimization import optimize_queryset
+
+from .fake_project import (
+    Query,
+    TestCategory,
+    TestItem,
+    TestItemType,
+    TestProduct,
+    schema,
+)
 
 import logging
-
-@pytest.fixture
+import re
+from functools import partial
+from types import SimpleNamespace
+from unittest import mock
+
+
+class ValidatedBackend(GraphQLCoreBackend):
+    """Validate each document once, when it is parsed, instead of on every execution"""
+
+    def document_from_string(self, schema, document_string):
+        document = super(ValidatedBackend, self).document_from_string(
+            schema, document_string
+        )
+        errors = validate(schema, document.document_ast)
+        if errors:
+            document.execute = lambda *args, **kwargs: ExecutionResult(
+                errors=errors, invalid=True
+            )
+        else:
+            document.execute = partial(
+                execute, schema, document.document_ast, **self.execute_params
+            )
+        return document
+
+
+# Parse and validate each distinct query document once for the whole run
+_BACKEND = GraphQLCachedBackend(ValidatedBackend())
+
+_FACTORY = RequestFactory()
+
+_COUNT_RE = re.compile(r"\bCOUNT\s*\(", re.IGNORECASE)
+
+_SEED = (
+    ("Apple", 10),
+    ("Banana", 5),
+    ("Cherry", 15),
+    ("Date", 8),
+    ("Elderberry", 12),
+    ("Fig", 3),
+    ("Grape", 20),
+    ("Honeydew", 7),
+)
+
+# One template per distinct query shape, filled in with str.format
+_Q_ITEMS_FULL = """
+query {{
+    {field} {{
+        results {{
+            id
+            name
+            value
+        }}
+        pageInfo {{
+            hasNextPage
+            hasPreviousPage
+        }}
+        totalCount
+    }}
+}}
+"""
+
+_Q_ITEMS_LIMIT = """
+query {{
+    items(limit: {limit}) {{
+        results {{
+            id
+        }}
+    }}
+}}
+"""
+
+
+def clear_table(model):
+    """Delete all rows with plain SQL, skipping the ORM's collector and signals"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
+
+
+@pytest.fixture(autouse=True)
+def rollback():
+    """Run each test in a transaction that is rolled back afterwards"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@pytest.fixture(scope="module")
 def sample_data():
-    TestItem.objects.all().delete()  # Clear existing data
-    items = [
-        TestItem(name="Apple", value=10),
-        TestItem(name="Banana", value=5),
-        TestItem(name="Cherry", value=15),
-        TestItem(name="Date", value=8),
-        TestItem(name="Elderberry", value=12),
-        TestItem(name="Fig", value=3),
-        TestItem(name="Grape", value=20),
-        TestItem(name="Honeydew", value=7),
-    ]
-    TestItem.objects.bulk_create(items)
+    """Seed the items once; each test's changes are rolled back"""
+    clear_table(TestItem)  # Clear existing data
+    items = [TestItem(name=name, value=value) for name, value in _SEED]
+    TestItem.objects.bulk_create(items, batch_size=len(items))
     return items
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def client():
     """GraphQL client with Django request context"""
-    from graphene.test import Client
-
-    factory = RequestFactory()
-    request = factory.get("/")
 
-    _client = Client(schema)
+    # The library keeps per-request state (cached totals, loaders) on the
+    # context, so every execution gets a fresh request
+    def execute(query, variables=None):
+        result = schema.execute(
+            query,
+            variable_values=variables,
+            context_value=_FACTORY.get("/"),
+            backend=_BACKEND,
+        )
+        return result.to_dict(dict_class=dict)
 
-    original_execute = _client.execute
-
-    def execute_with_context(query, variables=None):
-        return original_execute(query, variables=variables, context=request)
-
-    _client.execute = execute_with_context
-    return _client
+    return SimpleNamespace(execute=execute)
 
 
 @pytest.mark.django_db
 class TestPaginationE2E:
     """End-to-end tests for pagination library"""
 
-    def test_basic_query_all_results(self, client, sample_data):
-        """Test query without pagination returns all items"""
-        query = """
-        query {
-            items {
-                results {
-                    id
-                    name
-                    value
-                }
-                pageInfo {
-                    hasNextPage
-                    hasPreviousPage
-                }
-                totalCount
-            }
-        }
-        """
-
-        result = client.execute(query)
-        assert not result.get("errors"), f"Errors: {result.get('errors')}"
-
-        data = result["data"]["items"]
-        assert len(data["results"]) == 8
-        assert data["totalCount"] == 8
-        assert data["pageInfo"]["hasNextPage"] == False
-        assert data["pageInfo"]["hasPreviousPage"] == False
-
-    def test_pagination_first_page(self, client, sample_data):
-        """Test first page with limit"""
-        query = """
-        query {
-            items(limit: 3) {
-                results {
-                    id
-                    name
-                    value
-                }
-                pageInfo {
-                    hasNextPage
-                    hasPreviousPage
-                }
-                totalCount
-            }
-        }
-        """
+    @pytest.mark.parametrize(
+        "limit,offset,count,has_next,has_previous",
+        [
+            (None, None, 8, False, False),  # all results
+            (3, None, 3, True, False),  # first page
+            (3, 3, 3, True, True),  # middle page
+            (3, 6, 2, False, True),  # last page, only 2 items left
+            (5, 20, 0, False, True),  # offset beyond available data
+        ],
+    )
+    def test_pagination(self, client, sample_data, limit, offset, count, has_next, has_previous):
+        """Test pages for a given limit and offset"""
+        arguments = ", ".join(
+            f"{name}: {value}"
+            for name, value in (("limit", limit), ("offset", offset))
+            if value is not None
+        )
+        field = f"items({arguments})" if arguments else "items"
+        query = _Q_ITEMS_FULL.format(field=field)
 
         result = client.execute(query)
         assert not result.get("errors"), f"Errors: {result.get('errors')}"
 
         data = result["data"]["items"]
-        assert len(data["results"]) == 3
+        assert len(data["results"]) == count
         assert data["totalCount"] == 8
-        assert data["pageInfo"]["hasNextPage"] == True
-        assert data["pageInfo"]["hasPreviousPage"] == False
-
-    def test_pagination_middle_page(self, client, sample_data):
-        """Test middle page with limit and offset"""
-        query = """
-        query {
-            items(limit: 3, offset: 3) {
-                results {
-                    id
-                    name
-                    value
-                }
-                pageInfo {
-                    hasNextPage
-                    hasPreviousPage
-                }
-                totalCount
-            }
-        }
-        """
-
-        result = client.execute(query)
-        assert not result.get("errors"), f"Errors: {result.get('errors')}"
-
-        data = result["data"]["items"]
-        assert len(data["results"]) == 3
-        assert data["totalCount"] == 8
-        assert data["pageInfo"]["hasNextPage"] == True
-        assert data["pageInfo"]["hasPreviousPage"] == True
-
-    def test_pagination_last_page(self, client, sample_data):
-        """Test last page"""
-        query = """
-        query {
-            items(limit: 3, offset: 6) {
-                results {
-                    id
-                    name
-                    value
-                }
-                pageInfo {
-                    hasNextPage
-                    hasPreviousPage
-                }
-                totalCount
-            }
-        }
-        """
-
-        result = client.execute(query)
-        assert not result.get("errors"), f"Errors: {result.get('errors')}"
-
-        data = result["data"]["items"]
-        assert len(data["results"]) == 2  # Only 2 items left
-        assert data["totalCount"] == 8
-        assert data["pageInfo"]["hasNextPage"] == False
-        assert data["pageInfo"]["hasPreviousPage"] == True
+        assert data["pageInfo"]["hasNextPage"] == has_next
+        assert data["pageInfo"]["hasPreviousPage"] == has_previous
 
     def test_ordering_ascending(self, client, sample_data):
         """Test ordering by name ascending"""
-        query = """
-        query {
-            items(limit: 4, ordering: "name, asc") {
-                results {
-                    id
-                    name
-                    value
-                }
-                totalCount
-            }
-        }
-        """
+        query = _Q_ITEMS_FULL.format(field='items(limit: 4, ordering: "name, asc")')
 
         result = client.execute(query)
         assert not result.get("errors"), f"Errors: {result.get('errors')}"
@@ -187,18 +195,7 @@ class TestPaginationE2E:
 
     def test_ordering_descending(self, client, sample_data):
         """Test ordering by value descending"""
-        query = """
-        query {
-            items(limit: 4, ordering: "value, desc") {
-                results {
-                    id
-                    name
-                    value
-                }
-                totalCount
-            }
-        }
-        """
+        query = _Q_ITEMS_FULL.format(field='items(limit: 4, ordering: "value, desc")')
 
         result = client.execute(query)
         assert not result.get("errors"), f"Errors: {result.get('errors')}"
@@ -243,7 +240,7 @@ class TestPaginationE2E:
 
     def test_empty_results(self, client):
         """Test with empty data"""
-        TestItem.objects.all().delete()
+        clear_table(TestItem)
 
         query = """
         query {
@@ -270,53 +267,11 @@ class TestPaginationE2E:
         assert data["pageInfo"]["hasNextPage"] == False
         assert data["pageInfo"]["hasPreviousPage"] == False
 
-    def test_large_offset(self, client, sample_data):
-        """Test offset beyond available data"""
-        query = """
-        query {
-            items(limit: 5, offset: 20) {
-                results {
-                    id
-                    name
-                }
-                pageInfo {
-                    hasNextPage
-                    hasPreviousPage
-                }
-                totalCount
-            }
-        }
-        """
-
-        result = client.execute(query)
-        assert not result.get("errors"), f"Errors: {result.get('errors')}"
-
-        data = result["data"]["items"]
-        assert len(data["results"]) == 0
-        assert data["totalCount"] == 8
-        assert data["pageInfo"]["hasNextPage"] == False
-        assert data["pageInfo"]["hasPreviousPage"] == True
-
     def test_non_aligned_offset(self, client, sample_data):
         """Test pagination with non-aligned offset (offset not divisible by limit)"""
         # With 8 items total, offset=7, limit=3 should return 1 item (index 7)
         # This tests the page number calculation fix for non-aligned offsets
-        query = """
-        query {
-            items(limit: 3, offset: 7) {
-                results {
-                    id
-                    name
-                    value
-                }
-                pageInfo {
-                    hasNextPage
-                    hasPreviousPage
-                }
-                totalCount
-            }
-        }
-        """
+        query = _Q_ITEMS_FULL.format(field="items(limit: 3, offset: 7)")
 
         result = client.execute(query)
         assert not result.get("errors"), f"Errors: {result.get('errors')}"
@@ -334,35 +289,19 @@ class TestErrorHandling:
 
     def test_negative_limit(self, client, sample_data):
         """Test negative limit raises error"""
-        query = """
-        query {
-            items(limit: -1) {
-                results {
-                    id
-                }
-            }
-        }
-        """
+        query = _Q_ITEMS_LIMIT.format(limit=-1)
 
         result = client.execute(query)
         assert result.get("errors")
-        assert any("positive integer" in str(error) for error in result["errors"])
+        assert any("positive integer" in error.get("message", "") for error in result["errors"])
 
     def test_zero_limit(self, client, sample_data):
         """Test zero limit raises error"""
-        query = """
-        query {
-            items(limit: 0) {
-                results {
-                    id
-                }
-            }
-        }
-        """
+        query = _Q_ITEMS_LIMIT.format(limit=0)
 
         result = client.execute(query)
         assert result.get("errors")
-        assert any("positive integer" in str(error) for error in result["errors"])
+        assert any("positive integer" in error.get("message", "") for error in result["errors"])
 
 
 @pytest.mark.django_db
@@ -396,18 +335,29 @@ class TestPageInfo:
 class TestTotalCount:
     """Test total count functionality"""
 
-    def test_total_count_consistent(self, client, sample_data):
+    @pytest.mark.parametrize("offset", [0, 3, 6])
+    def test_total_count_consistent(self, client, sample_data, offset):
         """Test total count is consistent across pages"""
-        queries = [
-            "query { items(limit: 3, offset: 0) { totalCount } }",
-            "query { items(limit: 3, offset: 3) { totalCount } }",
-            "query { items(limit: 3, offset: 6) { totalCount } }",
-        ]
+        query = f"query {{ items(limit: 3, offset: {offset}) {{ totalCount }} }}"
 
-        for query in queries:
-            result = client.execute(query)
-            assert not result.get("errors"), f"Errors: {result.get('errors')}"
-            assert result["data"]["items"]["totalCount"] == 8
+        result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+        assert result["data"]["items"]["totalCount"] == 8
+
+    def test_total_count_consistent_in_one_request(self, client, sample_data):
+        """Test pages fetched together through aliases each report the total"""
+        query = """
+        query {
+            a: items(limit: 3, offset: 0) { totalCount }
+            b: items(limit: 3, offset: 3) { totalCount }
+            c: items(limit: 3, offset: 6) { totalCount }
+        }
+        """
+
+        result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+        for alias in ("a", "b", "c"):
+            assert result["data"][alias]["totalCount"] == 8
 
 
 @pytest.mark.django_db
@@ -548,6 +498,16 @@ class TestMaxLimit:
         assert "limit 10 exceeded max_limit 3" in caplog.text
         assert "TestQuery" in caplog.text
 
+    def test_logs_unknown_name_for_anonymous_query(self, client, sample_data, caplog):
+        """Test that the warning names anonymous queries as unknown"""
+        query = "query { itemsLimited(limit: 10) { results { id } } }"
+
+        with caplog.at_level(logging.WARNING):
+            result = client.execute(query)
+
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+        assert "Query 'unknown' limit 10 exceeded max_limit 3" in caplog.text
+
 
 @pytest.mark.django_db
 class TestCountOptimization:
@@ -584,23 +544,23 @@ class TestCountOptimization:
             assert data["pageInfo"]["hasNextPage"] == False
             assert data["pageInfo"]["hasPreviousPage"] == True
 
-            # Check that no COUNT query was executed
+            # Check that no separate COUNT query was executed
             # We should only have one SELECT query for fetching the items
-            queries = [q['sql'] for q in context.captured_queries]
-            count_queries = [q for q in queries if 'COUNT' in q.upper()]
-
-            assert len(count_queries) == 0, f"Expected no COUNT queries, but found: {count_queries}"
+            assert len(context.captured_queries) == 1, (
+                f"Expected a single query, but found: "
+                f"{[q['sql'] for q in context.captured_queries]}"
+            )
 
     def test_first_page_partial_skips_count_query(self, client):
         """Test that COUNT query is skipped on first page when total items < limit"""
         # Create only 3 items but request limit of 5
-        TestItem.objects.all().delete()
+        clear_table(TestItem)
         items = [
             TestItem(name="Apple", value=10),
             TestItem(name="Banana", value=5),
             TestItem(name="Cherry", value=15),
         ]
-        TestItem.objects.bulk_create(items)
+        TestItem.objects.bulk_create(items, batch_size=len(items))
 
         query = """
         query {
@@ -629,16 +589,17 @@ class TestCountOptimization:
             assert data["pageInfo"]["hasNextPage"] == False
             assert data["pageInfo"]["hasPreviousPage"] == False
 
-            # Check that no COUNT query was executed
-            queries = [q['sql'] for q in context.captured_queries]
-            count_queries = [q for q in queries if 'COUNT' in q.upper()]
-
-            assert len(count_queries) == 0, f"Expected no COUNT queries, but found: {count_queries}"
-
-    def test_middle_page_with_full_limit_does_count_query(self, client, sample_data):
-        """Test that COUNT query IS executed when we get exactly 'limit' items (not on last page)"""
-        # Query a middle page where we'll get exactly 'limit' items
-        # Since items == limit, we need COUNT to check if there are more pages
+            # Check that no separate COUNT query was executed
+            assert len(context.captured_queries) == 1, (
+                f"Expected a single query, but found: "
+                f"{[q['sql'] for q in context.captured_queries]}"
+            )
+
+    def test_middle_page_counts_without_window_support(self, client, sample_data, monkeypatch):
+        """Test that totalCount on a full page runs a COUNT query when window functions are unavailable"""
+        # The next page is detected from the extra fetched row, but the total
+        # can only come from a separate COUNT without COUNT(*) OVER ()
+        monkeypatch.setattr(connection.features, "supports_over_clause", False)
         query = """
         query {
             items(limit: 3, offset: 3) {
@@ -666,8 +627,489 @@ class TestCountOptimization:
             assert data["pageInfo"]["hasNextPage"] == True
             assert data["pageInfo"]["hasPreviousPage"] == True
 
-            # Check that a COUNT query WAS executed (since we got exactly 'limit' items)
+            # Check that the page was fetched on its own and counted separately
             queries = [q['sql'] for q in context.captured_queries]
-            count_queries = [q for q in queries if 'COUNT' in q.upper()]
+            count_queries = [q for q in queries if _COUNT_RE.search(q)]
+
+            assert len(queries) == 2, f"Expected a page query and a COUNT query, but found: {queries}"
+            assert len(count_queries) == 1, f"Expected one COUNT query for middle page, but found: {count_queries}"
+            assert "OVER" not in queries[0].upper(), f"Expected no window count, but found: {queries[0]}"
+
+    @pytest.mark.skipif(
+        not connection.features.supports_over_clause,
+        reason="Window functions are not supported by the database",
+    )
+    def test_middle_page_fetches_total_count_with_page(self, client, sample_data):
+        """Test that totalCount on a full page is fetched in the same query as the items"""
+        query = """
+        query {
+            items(limit: 3, offset: 3) {
+                results {
+                    id
+                }
+                totalCount
+            }
+        }
+        """
+
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(query)
+            assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+            data = result["data"]["items"]
+            assert len(data["results"]) == 3
+            assert data["totalCount"] == 8
+
+            assert len(context.captured_queries) == 1, (
+                f"Expected a single query, but found: "
+                f"{[q['sql'] for q in context.captured_queries]}"
+            )
+
+    def test_sliced_queryset_total_count_respects_slice(self, client, sample_data):
+        """Test totalCount of a queryset sliced by its resolver counts only the slice"""
+        query = "query { topItems(limit: 2, offset: 2) { results { id } totalCount } }"
+
+        result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+        assert result["data"]["topItems"]["totalCount"] == 5
+
+    def test_middle_page_without_total_count_skips_count_query(self, client, sample_data):
+        """Test that COUNT query is skipped on a full page when totalCount is not requested"""
+        query = """
+        query {
+            items(limit: 3, offset: 3) {
+                results {
+                    id
+                    name
+                }
+                pageInfo {
+                    hasNextPage
+                    hasPreviousPage
+                }
+            }
+        }
+        """
+
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(query)
+            assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+            # Verify the results are correct
+            data = result["data"]["items"]
+            assert len(data["results"]) == 3
+            assert data["pageInfo"]["hasNextPage"] == True
+            assert data["pageInfo"]["hasPreviousPage"] == True
+
+            # Check that no COUNT query was executed, including a window count
+            # on the page query itself
+            count_queries = [
+                q['sql'] for q in context.captured_queries if _COUNT_RE.search(q['sql'])
+            ]
+            assert not count_queries, f"Expected no COUNT queries, but found: {count_queries}"
+
+
+class TestConnectionType:
+    """Test the connection type built by the field"""
+
+    def test_type_is_built_once(self):
+        """Test repeated type access returns the same connection class"""
+        field = Query._meta.fields["items"]
+        assert field.type is field.type
+
+    def test_promise_resolver(self, sample_data):
+        """Test a resolver returning a promise of a queryset is paginated"""
+
+        class PromiseQuery(ObjectType):
+            items = DjangoPaginationConnectionField(TestItemType)
+
+            def resolve_items(self, info, **kwargs):
+                return Promise.resolve(TestItem.objects.order_by("value"))
+
+        query = "query { items(limit: 3) { results { value } totalCount } }"
+        result = Schema(query=PromiseQuery).execute(
+            query, context_value=_FACTORY.get("/")
+        )
+        assert not result.errors, f"Errors: {result.errors}"
+
+        data = result.data["items"]
+        assert [item["value"] for item in data["results"]] == [3, 5, 7]
+        assert data["totalCount"] == 8
+
+
+class TestOrderingField:
+    """Test conversion of ordering field names"""
+
+    @pytest.mark.parametrize(
+        "name,expected",
+        [
+            ("name", "name"),
+            ("createdAt", "created_at"),
+            ("CreatedAt", "created_at"),
+            ("someLongFieldName", "some_long_field_name"),
+            ("field_1", "field_1"),
+        ],
+    )
+    def test_camel_to_snake(self, name, expected):
+        """Test camelCase names are converted to snake_case"""
+        assert _camel_to_snake(name) == expected
+
+
+@pytest.mark.django_db
+class TestDeepOffset:
+    """Test fetching pages past the primary key slicing threshold"""
+
+    def test_pk_slice_keeps_ordering(self, client, sample_data, monkeypatch):
+        """Test pages fetched by primary key keep the requested ordering"""
+        query = 'query { items(limit: 3, offset: 2, ordering: "value, desc") { results { value } } }'
+        expected = client.execute(query)["data"]["items"]["results"]
+
+        monkeypatch.setattr(connection_field, "PK_SLICE_OFFSET_THRESHOLD", 0)
+        result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        assert result["data"]["items"]["results"] == expected
+        assert [item["value"] for item in expected] == [12, 10, 8]
+
+    def test_values_queryset_is_sliced_directly(self, sample_data, monkeypatch):
+        """Test deep pages of values() querysets are sliced without the pk lookup"""
+        monkeypatch.setattr(connection_field, "PK_SLICE_OFFSET_THRESHOLD", 0)
+        connection = connection_from_list_slice(
+            TestItem.objects.order_by("value").values("name", "value"),
+            {"limit": 3, "offset": 2},
+            connection_type=dict,
+            pageinfo_type=PageInfoExtra,
+            info=SimpleNamespace(context=SimpleNamespace()),
+        )
+
+        assert connection["results"] == [
+            {"name": "Honeydew", "value": 7},
+            {"name": "Date", "value": 8},
+            {"name": "Apple", "value": 10},
+        ]
+
+
+    def test_sliced_queryset_at_deep_offset(self, client, sample_data, monkeypatch):
+        """Test deep pages of a queryset sliced by its resolver are sliced directly"""
+        monkeypatch.setattr(connection_field, "PK_SLICE_OFFSET_THRESHOLD", 1)
+        result = client.execute("query { topItems(limit: 2, offset: 2) { results { name } } }")
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        names = [item["name"] for item in result["data"]["topItems"]["results"]]
+        assert names == ["Cherry", "Date"]
+
+@pytest.mark.django_db
+class TestUnlimited:
+    """Test results without a limit"""
+
+    def test_queryset_results_are_streamed(self, sample_data):
+        """Test unlimited QuerySet results are iterated instead of loaded at once"""
+        connection = connection_from_list_slice(
+            TestItem.objects.order_by("value"),
+            connection_type=dict,
+            pageinfo_type=PageInfoExtra,
+        )
+
+        assert not isinstance(connection["results"], (list, QuerySet))
+        assert [item.value for item in connection["results"]] == [3, 5, 7, 8, 10, 12, 15, 20]
+
+    def test_streamed_results_can_be_selected_twice(self, sample_data, monkeypatch):
+        """Test aliased results each get every row when results are streamed"""
+        monkeypatch.setattr(graphene_settings, "RELAY_CONNECTION_MAX_LIMIT", None)
+
+        class UnlimitedQuery(ObjectType):
+            items = DjangoPaginationConnectionField(TestItemType)
+
+            def resolve_items(self, info, **kwargs):
+                return TestItem.objects.order_by("value")
+
+        query = "query { items { a: results { value } b: results { name } } }"
+        result = Schema(query=UnlimitedQuery).execute(
+            query, context_value=_FACTORY.get("/")
+        )
+        assert not result.errors, f"Errors: {result.errors}"
+
+        data = result.data["items"]
+        assert [item["value"] for item in data["a"]] == [3, 5, 7, 8, 10, 12, 15, 20]
+        assert len(data["b"]) == 8
+
+
+@pytest.mark.django_db
+class TestLoader:
+    """Test the per-request model loader"""
+
+    def test_loader_is_primed_with_page_results(self, client, sample_data):
+        """Test instances from a page are loaded without querying them again"""
+        pks = list(TestItem.objects.order_by("id").values_list("pk", flat=True)[:3])
+        query = """
+        query {
+            items(limit: 3, ordering: "id, asc") {
+                results {
+                    id
+                }
+            }
+            itemsByPk(pks: %s) {
+                name
+            }
+        }
+        """ % pks
+
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        names = [item["name"] for item in result["data"]["itemsByPk"]]
+        assert names == ["Apple", "Banana", "Cherry"]
+        assert len(context.captured_queries) == 1
+
+    def test_loader_batches_lookups(self, client, sample_data):
+        """Test loads issued together are fetched in a single query"""
+        pks = list(TestItem.objects.order_by("id").values_list("pk", flat=True)[:4])
+        query = "query { itemsByPk(pks: %s) { name } }" % pks
+
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        names = [item["name"] for item in result["data"]["itemsByPk"]]
+        assert names == ["Apple", "Banana", "Cherry", "Date"]
+        assert len(context.captured_queries) == 1
+
+
+@pytest.fixture
+def related_data():
+    clear_table(TestProduct)
+    clear_table(TestCategory)
+    fruits = TestCategory.objects.create(name="Fruits")
+    drinks = TestCategory.objects.create(name="Drinks")
+    TestProduct.objects.bulk_create(
+        [
+            TestProduct(name="Apple", category=fruits),
+            TestProduct(name="Banana", category=fruits),
+            TestProduct(name="Juice", category=drinks),
+        ]
+    )
+
+
+@pytest.mark.django_db
+class TestQueryOptimization:
+    """Test relations selected in results are joined or prefetched"""
+
+    def test_foreign_key_is_joined(self, client, related_data):
+        """Test a selected foreign key is fetched with the page in one query"""
+        query = """
+        query {
+            products {
+                results {
+                    name
+                    category {
+                        name
+                    }
+                }
+            }
+        }
+        """
+
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        results = result["data"]["products"]["results"]
+        assert [item["category"]["name"] for item in results] == ["Fruits", "Fruits", "Drinks"]
+        assert len(context.captured_queries) == 1
+
+    def test_reverse_relation_is_prefetched(self, client, related_data):
+        """Test a selected reverse relation is fetched in a single extra query"""
+        query = """
+        query {
+            categories {
+                results {
+                    ...CategoryFields
+                }
+            }
+        }
+
+        fragment CategoryFields on TestCategoryType {
+            name
+            products {
+                name
+            }
+        }
+        """
+
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        results = result["data"]["categories"]["results"]
+        assert [len(item["products"]) for item in results] == [2, 1]
+        assert len(context.captured_queries) == 2
+
+    def test_select_related_hint(self, client, related_data):
+        """Test a node type's select_related hint joins the relation its field reads"""
+        query = "query { products { results { name categoryName } } }"
+
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        results = result["data"]["products"]["results"]
+        assert [item["categoryName"] for item in results] == ["Fruits", "Fruits", "Drinks"]
+        assert len(context.captured_queries) == 1
+
+    def test_prefetch_related_hint(self, client, related_data):
+        """Test a node type's prefetch_related hint prefetches the relation its field reads"""
+        query = "query { categories { results { name productNames } } }"
+
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        results = result["data"]["categories"]["results"]
+        assert [item["productNames"] for item in results] == [["Apple", "Banana"], ["Juice"]]
+        assert len(context.captured_queries) == 2
+
+    def test_select_related_hint_under_prefetched_relation(self, client, related_data, monkeypatch):
+        """Test a select_related hint below a prefetched relation is prefetched too"""
+        querysets = []
+
+        def record(*args):
+            querysets.append(optimize_queryset(*args))
+            return querysets[-1]
+
+        monkeypatch.setattr(connection_field, "optimize_queryset", record)
+        query = "query { categories { results { products { categoryName } } } }"
+
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        results = result["data"]["categories"]["results"]
+        assert [
+            [product["categoryName"] for product in item["products"]] for item in results
+        ] == [["Fruits", "Fruits"], ["Drinks"]]
+        assert querysets[0]._prefetch_related_lookups == ("products", "products__category")
+        assert not querysets[0].query.select_related
+        assert len(context.captured_queries) == 2
+
+
+@pytest.mark.django_db
+class TestCustomOrdering:
+    """Test ordering through the node type's ordering method"""
+
+    def test_node_ordering_is_used(self, client, related_data):
+        """Test the node type's ordering method handles the ordering argument"""
+        query = 'query { products(ordering: "categoryName, asc") { results { name } } }'
+
+        for _ in range(2):
+            result = client.execute(query)
+            assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+            names = [item["name"] for item in result["data"]["products"]["results"]]
+            assert names == ["Juice", "Apple", "Banana"]
+
+
+@pytest.mark.django_db
+class TestCountCache:
+    """Test caching of expensive total counts"""
+
+    query = "query { items(limit: 3, offset: 3) { totalCount } }"
+
+    @pytest.fixture(autouse=True)
+    def clear_count_cache(self):
+        """Start and end each test with an empty count cache"""
+        count_cache.clear()
+        yield
+        count_cache.clear()
+
+    def _count_queries(self, client):
+        with CaptureQueriesContext(connection) as context:
+            result = client.execute(self.query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+        assert result["data"]["items"]["totalCount"] == 8
+        return [q['sql'] for q in context.captured_queries if _COUNT_RE.search(q['sql'])]
+
+    def test_count_below_threshold_is_not_cached(self, client, sample_data):
+        """Test small counts are recomputed on every request"""
+        assert len(self._count_queries(client)) == 1
+        assert len(self._count_queries(client)) == 1
+
+    def test_count_above_threshold_is_cached(self, client, sample_data, monkeypatch):
+        """Test large counts are served from the cache on later requests"""
+        monkeypatch.setattr(connection_field, "COUNT_CACHE_THRESHOLD", 8)
+
+        assert len(self._count_queries(client)) == 1
+        assert len(self._count_queries(client)) == 0
+
+    def test_sliced_queryset_count_is_cached_separately(self, client, sample_data, monkeypatch):
+        """Test a queryset sliced by its resolver doesn't share the unsliced count"""
+        monkeypatch.setattr(connection_field, "COUNT_CACHE_THRESHOLD", 1)
+        monkeypatch.setattr(connection.features, "supports_over_clause", False)
+
+        result = client.execute('query { items(limit: 2, offset: 2, ordering: "id, asc") { totalCount } }')
+        assert result["data"]["items"]["totalCount"] == 8
+
+        result = client.execute("query { topItems(limit: 2, offset: 2) { totalCount } }")
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+        assert result["data"]["topItems"]["totalCount"] == 5
+
+    def test_stale_cached_count_does_not_hide_rows(self, client, sample_data, monkeypatch):
+        """Test pages past a cached total are still fetched from the database"""
+        monkeypatch.setattr(connection_field, "COUNT_CACHE_THRESHOLD", 8)
+        self._count_queries(client)
+        TestItem.objects.bulk_create(
+            [TestItem(name="Kiwi", value=4), TestItem(name="Lime", value=6)]
+        )
+
+        query = "query { items(limit: 3, offset: 8) { results { name } pageInfo { hasNextPage hasPreviousPage } totalCount } }"
+        result = client.execute(query)
+        assert not result.get("errors"), f"Errors: {result.get('errors')}"
+
+        data = result["data"]["items"]
+        assert [item["name"] for item in data["results"]] == ["Kiwi", "Lime"]
+        assert data["totalCount"] == 10
+        assert data["pageInfo"]["hasNextPage"] == False
+        assert data["pageInfo"]["hasPreviousPage"] == True
+
 
-            assert len(count_queries) >= 1, f"Expected at least one COUNT query for middle page, but found: {count_queries}"
+class TestCountEstimate:
+    """Test PostgreSQL planner estimates for total counts"""
+
+    def _estimate(self, monkeypatch, plan):
+        db = mock.MagicMock(vendor="postgresql")
+        cursor = db.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (plan,)
+        monkeypatch.setattr(connection_field, "connections", {"default": db})
+
+        estimate = connection_field._estimate_count(
+            TestItem.objects.all(), "SELECT 1", ()
+        )
+        return estimate, cursor
+
+    def test_estimate_disabled_by_default(self, monkeypatch):
+        """Test no EXPLAIN is run unless a threshold is set"""
+        estimate, cursor = self._estimate(monkeypatch, "[]")
+
+        assert estimate is None
+        cursor.execute.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "plan",
+        [
+            '[{"Plan": {"Node Type": "Seq Scan", "Plan Rows": 25000}}]',
+            [{"Plan": {"Node Type": "Seq Scan", "Plan Rows": 25000}}],
+        ],
+    )
+    def test_estimate_above_threshold(self, monkeypatch, plan):
+        """Test the row estimate is read from the JSON plan, as text or parsed"""
+        monkeypatch.setattr(connection_field, "ESTIMATE_COUNT_THRESHOLD", 10000)
+        estimate, cursor = self._estimate(monkeypatch, plan)
+
+        assert estimate == 25000
+        cursor.execute.assert_called_once_with("EXPLAIN (FORMAT JSON) SELECT 1", ())
+
+    def test_estimate_below_threshold(self, monkeypatch):
+        """Test small estimates fall back to an exact count"""
+        monkeypatch.setattr(connection_field, "ESTIMATE_COUNT_THRESHOLD", 10000)
+        plan = '[{"Plan": {"Node Type": "Seq Scan", "Plan Rows": 500}}]'
+
+        assert self._estimate(monkeypatch, plan)[0] is None